@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Curated model view for interactive topic curation: topics can be excluded from and included into the model again
+without copying and renormalizing the full document-topic (theta) and topic-word (phi) distributions on each change
+(as `tmtoolkit.topicmod.model_stats.exclude_topics()` does).
+
+The view keeps the original distributions and a mask of the included topics. The renormalization factor of each
+document (its probability mass on the included topics) is updated incrementally when topics are toggled. Everything
+derived from the curated model -- renormalized theta, marginal topic distributions per group of documents and
+topic-word relevance -- is only computed when it is requested and cached for the current mask. The caches for the
+most recently used masks are kept, so that toggling a topic back and forth is cheap. The similarity index is only built
+once over the original document-topic distribution; the mask is applied at query time (see
+`doc_similarity.DocTopicIndex.masked()`).
+
+Topics are always referred to by their index in the original model, so that topic numbers stay the same while
+curating. Per-topic results cover all topics of the original model; excluded topics get zero proportions or NaN
+relevance. Documents that only have probability mass on excluded topics (which can happen with sparsified compact
+models, see `model_store.py`) get a renormalization weight of zero, i.e. a zero row in theta, and are left out of the
+marginal topic distributions.
+
+Markus Konrad <markus.konrad@wzb.eu>
+"""
+
+from __future__ import division
+from collections import OrderedDict
+
+import numpy as np
+
+from doc_similarity import DocTopicIndex, MIN_DOC_MASS
+
+
+N_CACHED_MASKS = 8
+
+
+class CuratedModel(object):
+    """
+    Curated view on a topic model with document-topic distribution `doc_topic`, topic-word distribution `topic_word`
+    and document lengths `doc_lengths`. `vocab` and `doc_labels` are needed for word rankings and the similarity
+    index, respectively. `doc_meta` is optional meta data for the similarity index (see `doc_similarity.py`). Topics
+    with indices in `exclude` are excluded from the start.
+    """
+    def __init__(self, doc_topic, topic_word, doc_lengths, vocab=None, doc_labels=None, doc_meta=None, exclude=()):
+        self.doc_topic = np.asarray(doc_topic)
+        self.topic_word = np.asarray(topic_word)
+        self.doc_lengths = np.asarray(doc_lengths)
+        self.vocab = np.asarray(vocab) if vocab is not None else None
+        self.doc_labels = doc_labels
+        self.doc_meta = doc_meta
+
+        if self.doc_topic.shape[1] != self.topic_word.shape[0]:
+            raise ValueError('`doc_topic` and `topic_word` must have the same number of topics')
+        if len(self.doc_lengths) != self.doc_topic.shape[0]:
+            raise ValueError('`doc_lengths` must contain one entry per document in `doc_topic`')
+
+        self._included = np.ones(self.n_topics, dtype=bool)
+        # probability mass of each document on the included topics (1 / renormalization factor)
+        self._doc_mass = self.doc_topic.sum(axis=1, dtype=np.float64)
+        # sum of squared topic proportions of each document on the included topics (for cosine similarity)
+        self._doc_sq_mass = np.einsum('ij,ij->i', self.doc_topic, self.doc_topic, dtype=np.float64)
+        self._caches = OrderedDict()     # mask key -> dict with cached results for this mask
+        self._indices = {}               # similarity index over the original model per combination of index options
+        self._log_topic_word = None
+
+        self.exclude(exclude)
+
+    @classmethod
+    def from_model(cls, model, doc_meta=None, exclude=()):
+        """
+        Create a curated view on `model`, which must be a `model_store.CompactModel` (or any object with attributes
+        `doc_topic_`, `topic_word_`, `doc_lengths`, `vocab` and `doc_labels`).
+        """
+        return cls(model.doc_topic_, model.topic_word_, model.doc_lengths, vocab=model.vocab,
+                   doc_labels=model.doc_labels, doc_meta=doc_meta, exclude=exclude)
+
+    @property
+    def n_topics(self):
+        """Number of topics in the original model."""
+        return self.doc_topic.shape[1]
+
+    @property
+    def included_topics(self):
+        """Indices of the included topics."""
+        return np.where(self._included)[0]
+
+    @property
+    def excluded_topics(self):
+        """Indices of the excluded topics."""
+        return np.where(~self._included)[0]
+
+    def is_included(self, topic):
+        return bool(self._included[topic])
+
+    #%% changing the mask
+
+    def exclude(self, topics):
+        """Exclude `topics` (topic indices) from the model."""
+        self._set_included(topics, False)
+
+    def include(self, topics):
+        """Include `topics` (topic indices) in the model again."""
+        self._set_included(topics, True)
+
+    def toggle(self, topics):
+        """Toggle `topics` (topic indices), i.e. exclude them if they are included and vice versa."""
+        topics = np.unique(np.asarray(topics, dtype=np.int64))
+        currently_included = self._included[topics]
+        self.exclude(topics[currently_included])
+        self.include(topics[~currently_included])
+
+    def set_excluded(self, topics):
+        """Exclude exactly the `topics` (topic indices) and include all other topics."""
+        excl = np.zeros(self.n_topics, dtype=bool)
+        excl[np.asarray(topics, dtype=np.int64)] = True
+        self.include(np.where(~excl & ~self._included)[0])
+        self.exclude(np.where(excl & self._included)[0])
+
+    def _set_included(self, topics, included):
+        topics = np.unique(np.asarray(topics, dtype=np.int64))
+        topics = topics[self._included[topics] != included]    # only those that actually change
+        if len(topics) == 0:
+            return
+
+        if not included and np.sum(self._included) - len(topics) < 1:
+            raise ValueError('at least one topic must remain included')
+
+        # update the renormalization factors incrementally instead of summing over all included topics again
+        changed = self.doc_topic[:, topics]
+        mass_change = changed.sum(axis=1, dtype=np.float64)
+        sq_mass_change = np.einsum('ij,ij->i', changed, changed, dtype=np.float64)
+        if included:
+            self._doc_mass += mass_change
+            self._doc_sq_mass += sq_mass_change
+        else:
+            self._doc_mass -= mass_change
+            self._doc_sq_mass -= sq_mass_change
+        self._included[topics] = included
+
+    #%% cached results
+
+    def _cache(self):
+        """Return the cache for the current mask."""
+        key = self._included.tobytes()
+        if key in self._caches:
+            self._caches[key] = self._caches.pop(key)   # mark as most recently used
+        else:
+            if len(self._caches) >= N_CACHED_MASKS:
+                self._caches.popitem(last=False)
+            self._caches[key] = {}
+        return self._caches[key]
+
+    def _cached(self, name, compute):
+        cache = self._cache()
+        if name not in cache:
+            cache[name] = compute()
+        return cache[name]
+
+    @property
+    def doc_weights(self):
+        """
+        Renormalization factor for each document, i.e. 1 / (document's probability mass on included topics), or zero
+        if the document has no probability mass on the included topics.
+        """
+        def compute():
+            has_mass = self._doc_mass > MIN_DOC_MASS
+            weights = np.zeros(len(self._doc_mass))
+            weights[has_mass] = 1 / self._doc_mass[has_mass]
+            return weights
+        return self._cached('doc_weights', compute)
+
+    @property
+    def theta(self):
+        """
+        Renormalized document-topic distribution for the included topics only (documents x included topics). Documents
+        without probability mass on the included topics have a zero row.
+        """
+        return self._cached('theta', lambda: self.doc_topic[:, self._included] * self.doc_weights[:, np.newaxis])
+
+    @property
+    def phi(self):
+        """Topic-word distribution for the included topics only (included topics x vocabulary)."""
+        return self._cached('phi', lambda: self.topic_word[self._included])
+
+    def marginal_topic_distrib(self, doc_indices=None):
+        """
+        Marginal topic distribution over all documents or only those in `doc_indices`, taking the document lengths
+        into account (like `tmtoolkit.topicmod.model_stats.get_marginal_topic_distrib()`). Documents without
+        probability mass on the included topics are left out. Return an array with one proportion per topic of the
+        original model (zero for excluded topics).
+        """
+        if doc_indices is None:
+            return self._cached('marginal_topic_distrib', lambda: self._marginal_topic_distrib(slice(None)))
+        else:
+            return self._marginal_topic_distrib(np.asarray(doc_indices))
+
+    def _marginal_topic_distrib(self, docs):
+        weights = self.doc_weights[docs]
+        w = self.doc_lengths[docs] * weights
+        marginal = np.zeros(self.n_topics)
+        total_length = np.sum(self.doc_lengths[docs][weights > 0])
+        if total_length > 0:
+            marginal[self._included] = np.dot(w, self.doc_topic[docs][:, self._included]) / total_length
+        return marginal
+
+    def marginal_topic_distrib_per_group(self, groups):
+        """
+        Marginal topic distribution for each group of documents in `groups`, a dict that maps a group name to document
+        indices. Results are cached for the current mask per group name and document indices. Return a dict that maps
+        each group name to an array as returned by `marginal_topic_distrib()`.
+        """
+        cache = self._cached('marginal_topic_distrib_per_group', dict)
+        res = {}
+        for name, doc_indices in groups.items():
+            doc_indices = np.asarray(doc_indices, dtype=np.int64)
+            key = (name, doc_indices.tobytes())
+            if key not in cache:
+                cache[key] = self._marginal_topic_distrib(doc_indices)
+            res[name] = cache[key]
+        return res
+
+    def marginal_word_distrib(self):
+        """Marginal word distribution of the curated model."""
+        return self._cached('marginal_word_distrib',
+                            lambda: np.dot(self.marginal_topic_distrib()[self._included], self.phi))
+
+    def topic_word_relevance(self, lambda_):
+        """
+        Topic-word relevance for the curated model with weight `lambda_` (like
+        `tmtoolkit.topicmod.model_stats.get_topic_word_relevance()`). Return a matrix with one row per topic of the
+        original model (NaN rows for excluded topics). Words with zero probability in a topic (e.g. in sparsified
+        compact models) get a relevance of -inf for this topic.
+        """
+        def compute():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                if self._log_topic_word is None:    # independent of the mask, hence only computed once
+                    self._log_topic_word = np.log(self.topic_word)
+                log_phi = self._log_topic_word[self._included]
+                log_lift = log_phi - np.log(self.marginal_word_distrib())
+                rel_included = lambda_ * log_phi + (1 - lambda_) * log_lift
+            rel_included[(self.phi == 0) | ~np.isfinite(rel_included)] = -np.inf
+            rel = np.full(self.topic_word.shape, np.nan)
+            rel[self._included] = rel_included
+            return rel
+        return self._cached(('topic_word_relevance', lambda_), compute)
+
+    def most_relevant_words_for_topic(self, topic, n, lambda_):
+        """Return the `n` most relevant words for `topic` (topic index) with relevance weight `lambda_`."""
+        if self.vocab is None:
+            raise ValueError('`vocab` is needed for word rankings')
+        if not self._included[topic]:
+            raise ValueError('topic %d is excluded' % topic)
+        rel = self.topic_word_relevance(lambda_)[topic]
+        return self.vocab[np.argsort(rel)[::-1][:n]]
+
+    def similarity_index(self, **index_kwargs):
+        """
+        Return a `doc_similarity.DocTopicIndex` for the curated model, i.e. a view of the index over the original
+        document-topic distribution that is masked with the included topics. `index_kwargs` (e.g. `approximate=True`)
+        are passed to `DocTopicIndex`. The index over the original model (including its clusters in approximate mode)
+        is only built once per combination of `index_kwargs`; the view is cached for the current mask. Queries to the
+        index are given over all topics of the original model.
+        """
+        if self.doc_labels is None:
+            raise ValueError('`doc_labels` are needed for the similarity index')
+        key = tuple(sorted(index_kwargs.items()))
+        if key not in self._indices:
+            self._indices[key] = DocTopicIndex(self.doc_topic, self.doc_labels, doc_meta=self.doc_meta,
+                                               **index_kwargs)
+        index = self._indices[key]
+        return self._cached(('similarity_index', key),
+                            lambda: index.masked(self._included.copy(), self._doc_mass.copy(),
+                                                 self._doc_sq_mass.copy()))
+
+    def similarity_query(self, topic_mixtures, index_kwargs=None, **query_kwargs):
+        """
+        Query the similarity index (see `similarity_index()`, created with `index_kwargs`) with `topic_mixtures` given
+        over all topics of the original model; the proportions of excluded topics are dropped. `query_kwargs` are
+        passed to `DocTopicIndex.query()`.
+        """
+        return self.similarity_index(**(index_kwargs or {})).query(topic_mixtures, **query_kwargs)
+
+    def similar_docs(self, docs, index_kwargs=None, **query_kwargs):
+        """
+        Find the documents most similar to `docs` in the curated model (see `DocTopicIndex.similar_docs()`, index
+        created with `index_kwargs`).
+        """
+        return self.similarity_index(**(index_kwargs or {})).similar_docs(docs, **query_kwargs)
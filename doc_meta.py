@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Meta data for the speeches in a model: session, TOP, speaker, party and date of each document. The session, TOP and
+speaker are encoded in the document labels generated in `generate_tokens.py`, the party comes from the MDB data and
+the date from the TOPs data.
+
+Markus Konrad <markus.konrad@wzb.eu>
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+
+SPEECHES_MERGED_PICKLE = 'data/speeches_merged.pickle'
+TOPS_CSV = 'data/offenesparlament-tops.csv'
+MDB_CSV = 'data/offenesparlament-mdb.csv'
+
+PTTRN_DOC_LABEL = re.compile(u'(\d+)_sess(\d+)_top([\d-]+)_spk_([a-zß0-9-]+)_seq(\d+)', re.UNICODE)
+
+
+def parse_doc_labels(doc_labels):
+    """
+    Return a data frame with the meta data that is encoded in `doc_labels`, i.e. the merged speech ID, session ID,
+    TOP ID, speaker fingerprint and sequence ID. The rows are in the same order as `doc_labels`.
+    """
+    doc_meta = []
+    for dl in doc_labels:
+        m = PTTRN_DOC_LABEL.search(dl)
+
+        doc_meta.append({
+            'doc_label': dl,
+            'merged_speech_id': int(m.group(1)),
+            'sess_id': int(m.group(2)),
+            'top_id': int(m.group(3)),
+            'speaker_fp': m.group(4),
+            'seq_id': int(m.group(5))
+        })
+
+    return pd.DataFrame(doc_meta)
+
+
+def load_session_dates(tops_csv=TOPS_CSV):
+    """Load the date of each session from the TOPs data."""
+    #tops = pd.read_csv(tops_csv, usecols=['id', 'sitzung', 'week', 'year', 'held_on', 'sequence'])
+    tops = pd.read_csv(tops_csv, usecols=['sitzung', 'held_on'])
+    assert sum(tops.sitzung.isna()) == 0
+    assert sum(tops.held_on.isna()) == 0
+    sess_dates = []
+    for sess, grp in tops.groupby('sitzung'):
+        date = grp.held_on.unique()
+        assert len(date) == 1
+        sess_dates.append({'sess_id': sess, 'date': date[0]})
+
+    sess_dates = pd.DataFrame(sess_dates)
+    sess_dates['date'] = pd.to_datetime(sess_dates.date)
+
+    return sess_dates
+
+
+def load_mdb(mdb_csv=MDB_CSV):
+    """Load the MDB data and generate a speaker fingerprint for each MDB like the one used in the speeches data."""
+    mdb = pd.read_csv(mdb_csv, usecols=['id', 'first_name', 'last_name', 'party'])
+
+    first_name_unicode = mdb.first_name.str.lower().str.decode('utf-8').values.astype(np.unicode_)
+    last_name_unicode = mdb.last_name.str.lower().str.decode('utf-8').values.astype(np.unicode_)
+
+    mdb['speaker_fp'] = np.core.defchararray.add(np.core.defchararray.add(first_name_unicode, u'-'), last_name_unicode)
+    for c1, c2 in zip(u'äöüé ', u'aoue-'):
+        mdb['speaker_fp'] = mdb['speaker_fp'].str.replace(c1, c2)
+
+    #mdb['speaker_fp'] = mdb.profile_url.str.extract(r'/([a-z0-9-]+)$')
+
+    assert sum(mdb['speaker_fp'].isna()) == 0
+
+    return mdb
+
+
+def load_doc_meta(doc_labels, speeches_merged_pickle=SPEECHES_MERGED_PICKLE, tops_csv=TOPS_CSV, mdb_csv=MDB_CSV):
+    """
+    Return a data frame with the meta data for the documents `doc_labels` including the party of the speaker and
+    the date of the session. The rows are in the same order as `doc_labels`.
+    """
+
+    # this is not so straight-forward because unfortunately there are many missing speaker_key values for the speeches,
+    # hence it is difficult to match speeches with speakers from the MDB data
+
+    speeches_merged = pd.read_pickle(speeches_merged_pickle)
+    sess_dates = load_session_dates(tops_csv)
+    mdb = load_mdb(mdb_csv)
+
+    doc_meta = parse_doc_labels(doc_labels)
+
+    # left join with raw speeches to get "speaker_key"
+    doc_meta = pd.merge(doc_meta, speeches_merged[['sequence', 'speaker_key']],
+                        left_on='seq_id', right_on='sequence', how='left')
+
+    # left join using "speaker_fp" will work in most cases
+    doc_meta = pd.merge(doc_meta, mdb, on='speaker_fp', how='left')
+    doc_meta['mdb_speaker_key'] = doc_meta.id.fillna(-1, downcast='infer')
+    del doc_meta['id']
+
+    # leaves about 1100 speeches not merged -> try to use the "speaker_key" from the raw speeches data now
+    doc_meta_gaps = doc_meta.loc[doc_meta.party.isna() & (doc_meta.speaker_key != -1),
+                                 ['merged_speech_id', 'speaker_key']]
+    doc_meta_gaps = pd.merge(doc_meta_gaps, mdb, left_on='speaker_key', right_on='id', how='left')
+    del doc_meta_gaps['id']
+
+    doc_meta_gaps.set_index('merged_speech_id', verify_integrity=True, inplace=True)
+    doc_meta.set_index('merged_speech_id', verify_integrity=True, inplace=True)
+
+    doc_meta.update(doc_meta_gaps)
+
+    n_no_mdb_data = sum(doc_meta.party.isna())
+
+    print('no MDB data found for %d speeches from %d overall speeches' % (n_no_mdb_data, len(doc_meta)))
+
+    # join with sess_dates to get dates of sessions
+    doc_meta = pd.merge(doc_meta, sess_dates, how='left', on='sess_id')
+    assert sum(doc_meta.date.isna()) == 0
+    assert list(doc_meta.doc_label) == list(doc_labels)
+
+    return doc_meta
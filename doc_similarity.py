@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+"""
+Document similarity index over the document-topic distributions (theta) of a model. Allows to find the speeches
+that are most similar to given speeches or closest to given topic mixtures under Hellinger, cosine or Jensen-Shannon
+distance.
+
+The index can work in two modes:
+
+- exact: the distances to all documents are computed in blocks of documents, so that even large batches of queries
+  need only limited memory
+- approximate: the documents are clustered with spherical k-means in Hellinger space (i.e. on the square roots of the
+  topic proportions); for each query, only the documents in the `n_probe` clusters closest to the query are compared
+  exactly
+
+An index can be restricted to a subset of the topics with `masked()` (used for curated models, see
+`curated_model.py`). The masked index shares all data with the full index; the excluded topics are dropped from the
+queries and the scores are rescaled per document as if the documents' topic distributions had been renormalized over
+the included topics.
+
+Queries can be restricted to documents matching meta data filters, e.g. `where={'party': 'SPD', 'sess_id': [1, 2],
+'date_range': ('2014-01-01', '2014-12-31')}`. The session, TOP and speaker are taken from the document labels. The
+party and date are only available when the index is built with the meta data from `doc_meta.load_doc_meta()`.
+
+Run as script to build the index for a model and save it next to the model file (either a pickled model or a compact
+model file, see `model_store.py`):
+
+  python doc_similarity.py <model file> [--approximate] [--no-speaker-meta]
+
+Markus Konrad <markus.konrad@wzb.eu>
+"""
+
+from __future__ import division
+import argparse
+import copy
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from doc_meta import SPEECHES_MERGED_PICKLE, TOPS_CSV, MDB_CSV, parse_doc_labels, load_doc_meta
+from model_store import load_compact_model
+
+
+METRICS = ('hellinger', 'cosine', 'jensen_shannon')
+
+DEFAULT_BLOCK_SIZE = 4096          # number of documents compared with the queries at once in exact mode
+JS_MAX_BLOCK_ELEMENTS = 2**23      # max. size of the temporary arrays when calculating Jensen-Shannon distances
+KMEANS_N_ITER = 15
+MIN_DOC_MASS = 1e-9                # documents with less probability mass on the included topics are treated as empty
+
+
+def index_path_for_model(model_file):
+    """Return the path of the similarity index file for the model stored in `model_file`."""
+    return os.path.splitext(model_file)[0] + '_simindex.pickle'
+
+
+def _normalize_rows(x, norm='l1'):
+    if norm == 'l1':
+        s = x.sum(axis=1, keepdims=True)
+    else:
+        s = np.sqrt((x**2).sum(axis=1, keepdims=True))
+    s[s == 0] = 1
+    return x / s
+
+
+def _entropy_rows(x):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return -np.where(x > 0, x * np.log(x), 0).sum(axis=-1)
+
+
+def _spherical_kmeans(x, n_clusters, n_iter=KMEANS_N_ITER, random_state=None):
+    """
+    Cluster the rows of `x` (which must have unit length) with spherical k-means. Return the centroids (unit length)
+    and the cluster index for each row.
+    """
+    rng = np.random.RandomState(random_state)
+    centroids = x[rng.choice(len(x), n_clusters, replace=False)]
+    assignments = None
+
+    for _ in range(n_iter):
+        new_assignments = np.argmax(np.dot(x, centroids.T), axis=1)
+        if assignments is not None and np.array_equal(assignments, new_assignments):
+            break
+        assignments = new_assignments
+
+        for c in range(n_clusters):
+            members = x[assignments == c]
+            if len(members) > 0:
+                centroids[c] = members.sum(axis=0)
+            else:   # re-seed empty cluster
+                centroids[c] = x[rng.randint(len(x))]
+        centroids = _normalize_rows(centroids, norm='l2')
+
+    return centroids, assignments
+
+
+class DocTopicIndex(object):
+    """
+    Similarity index over document-topic distributions `doc_topic` (documents x topics) with documents `doc_labels`.
+    `doc_meta` is an optional data frame with meta data for each document in the same order as `doc_labels` (e.g. from
+    `doc_meta.load_doc_meta()`) which is used for filtering. If it is not given, only the meta data encoded in the
+    document labels is available.
+
+    If `approximate` is True, queries are answered with the clustering-based approximate mode (see module docstring)
+    using `n_clusters` clusters (default: square root of the number of documents) of which the `n_probe` closest are
+    searched by default (default: a tenth of the clusters).
+    """
+    def __init__(self, doc_topic, doc_labels, doc_meta=None, approximate=False, n_clusters=None, n_probe=None,
+                 block_size=DEFAULT_BLOCK_SIZE, random_state=None):
+        doc_topic = np.asarray(doc_topic)
+        if doc_topic.ndim != 2 or doc_topic.shape[0] != len(doc_labels):
+            raise ValueError('`doc_topic` must be a matrix with one row per document in `doc_labels`')
+
+        if doc_meta is None:
+            doc_meta = parse_doc_labels(doc_labels)
+        elif len(doc_meta) != len(doc_labels):
+            raise ValueError('`doc_meta` must contain one row per document in `doc_labels`')
+
+        self.doc_topic = _normalize_rows(doc_topic.astype(np.float32))
+        self.doc_labels = np.asarray(doc_labels)
+        self.doc_meta = doc_meta.reset_index(drop=True)
+        self.block_size = block_size
+
+        self.approximate = approximate
+        self.centroids = None
+        self.cluster_members = None
+        self.n_probe = None
+
+        # set in masked indices only (see `masked()`)
+        self._topic_mask = None
+        self._doc_valid = None
+        self._doc_mass = None
+        self._doc_scale = None
+
+        self._init_derived()
+
+        if approximate:
+            n_clusters = n_clusters or max(1, int(round(np.sqrt(self.n_docs))))
+            n_clusters = min(n_clusters, self.n_docs)
+            self.n_probe = n_probe or max(1, n_clusters // 10)
+            self.centroids, assignments = _spherical_kmeans(self._doc_repr['hellinger'], n_clusters,
+                                                            random_state=random_state)
+            self.cluster_members = [np.where(assignments == c)[0] for c in range(n_clusters)]
+
+    def _init_derived(self):
+        """Set up the data that is derived from the document-topic distributions (not stored when saving)."""
+        self._doc_repr = {
+            'hellinger': np.sqrt(self.doc_topic),
+            'cosine': _normalize_rows(self.doc_topic, norm='l2'),
+            'jensen_shannon': self.doc_topic,
+        }
+        self._doc_entropy = _entropy_rows(self.doc_topic)
+        self._label_indices = dict((dl, i) for i, dl in enumerate(self.doc_labels))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for k in ('_doc_repr', '_doc_entropy', '_label_indices'):
+            del state[k]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_derived()
+
+    @property
+    def n_docs(self):
+        return self.doc_topic.shape[0]
+
+    @property
+    def n_topics(self):
+        return self.doc_topic.shape[1]
+
+    def save(self, path):
+        """Save the index to `path`."""
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def masked(self, included, doc_mass=None, doc_sq_mass=None):
+        """
+        Return a view of this index that only takes the topics in boolean mask `included` into account, i.e. as if it
+        was built over the document-topic distributions restricted to these topics and renormalized. The view shares
+        the document data and clusters with this index. `doc_mass` and `doc_sq_mass` are each document's sum of topic
+        proportions and of squared topic proportions on the included topics; they are calculated if not given.
+        Documents without probability mass on the included topics are never returned as results.
+
+        Queries to the view are still given over all topics; the proportions of excluded topics are dropped.
+        """
+        included = np.asarray(included, dtype=bool)
+        if included.shape != (self.n_topics,):
+            raise ValueError('`included` must be a boolean mask with one entry per topic')
+
+        if self._topic_mask is not None:
+            raise ValueError('the index is already masked; create the view from the full index')
+
+        mask_f = included.astype(np.float32)
+        if doc_mass is None:
+            doc_mass = np.dot(self.doc_topic, mask_f)
+        if doc_sq_mass is None:
+            doc_sq_mass = np.einsum('ij,ij,j->i', self.doc_topic, self.doc_topic, mask_f)
+
+        valid = (np.asarray(doc_mass) > MIN_DOC_MASS) & (np.asarray(doc_sq_mass) > 0)
+        doc_mass = np.where(valid, doc_mass, 1)
+        doc_sq_mass = np.where(valid, doc_sq_mass, 1)
+        doc_l2 = np.sqrt(np.einsum('ij,ij->i', self.doc_topic, self.doc_topic))
+
+        view = copy.copy(self)
+        view._topic_mask = included
+        view._doc_valid = valid
+        view._doc_mass = doc_mass.astype(np.float32)
+        view._doc_scale = {
+            # Bhattacharyya coefficient with the renormalized document: sum_t sqrt(q_t * p_t / m) = BC(q, p) / sqrt(m)
+            'hellinger': (1 / np.sqrt(doc_mass)).astype(np.float32),
+            # the cosine repr. is normalized by the norm over all topics, but must be normalized over the included ones
+            'cosine': (doc_l2 / np.sqrt(doc_sq_mass)).astype(np.float32),
+        }
+
+        return view
+
+    def doc_indices(self, docs):
+        """Return the indices of `docs`, which may be document labels or indices."""
+        return np.array([d if isinstance(d, (int, np.integer)) else self._label_indices[d] for d in docs],
+                        dtype=np.int64)
+
+    def filter_mask(self, where):
+        """
+        Return a boolean mask for all documents that match the conditions in dict `where`. Each key is a column in
+        the document meta data and each value is either a single value or a list, tuple or set of allowed values.
+        The special key `date_range` takes a tuple (start, end) of dates (inclusive; either may be None).
+        """
+        mask = np.ones(self.n_docs, dtype=bool)
+        for col, val in where.items():
+            if col == 'date_range':
+                col = 'date'
+            if col not in self.doc_meta.columns:
+                raise ValueError('column `%s` is not available in the document meta data; for party and date, build '
+                                 'the index with `doc_meta` from `doc_meta.load_doc_meta()`' % col)
+
+            values = self.doc_meta[col]
+            if col == 'date':
+                start, end = val
+                if start is not None:
+                    mask &= (values >= pd.Timestamp(start)).values
+                if end is not None:
+                    mask &= (values <= pd.Timestamp(end)).values
+            elif isinstance(val, (list, tuple, set)):
+                mask &= values.isin(val).values
+            else:
+                mask &= (values == val).values
+
+        return mask
+
+    def query(self, topic_mixtures, k=10, metric='hellinger', where=None, n_probe=None, exclude=None):
+        """
+        Find the `k` documents closest to each of the `topic_mixtures` (a single topic distribution or a matrix with
+        one distribution per row) under distance `metric` (one of `METRICS`).
+
+        `where` restricts the results to documents matching the meta data filters (see `filter_mask()`) and may also
+        be a boolean mask over all documents. In approximate mode, `n_probe` overrides the number of clusters that are
+        searched. `exclude` is an optional array with one document index per query that is left out of its results.
+
+        Return a tuple with document indices and distances, each of shape (number of queries, `k`) and sorted by
+        increasing distance. If fewer than `k` documents are found, the remaining places are filled with index -1 and
+        distance NaN.
+        """
+        if metric not in METRICS:
+            raise ValueError('`metric` must be one of %s' % ', '.join(METRICS))
+
+        queries = np.atleast_2d(np.asarray(topic_mixtures, dtype=np.float32))
+        if queries.shape[1] != self.n_topics:
+            raise ValueError('topic mixtures must have %d topics' % self.n_topics)
+        if self._topic_mask is not None:
+            queries = queries * self._topic_mask
+        queries = _normalize_rows(queries)
+
+        if where is None or isinstance(where, np.ndarray):
+            mask = where
+        else:
+            mask = self.filter_mask(where)
+
+        if exclude is not None:
+            exclude = np.asarray(exclude)
+
+        k = min(k, self.n_docs)
+
+        if self.approximate:
+            scores, indices = self._topk_approximate(queries, k, metric, mask, exclude, n_probe or self.n_probe)
+        else:
+            scores, indices = self._topk_exact(queries, k, metric, mask, exclude)
+
+        indices[~np.isfinite(scores)] = -1
+
+        return indices, self._scores_to_distances(scores, metric)
+
+    def similar_docs(self, docs, k=10, metric='hellinger', where=None, n_probe=None):
+        """
+        Find the `k` documents most similar to each document in `docs` (document labels or indices). The documents
+        themselves are not included in the results. Return the same as `query()`.
+        """
+        ind = self.doc_indices(docs)
+        return self.query(self.doc_topic[ind], k=k, metric=metric, where=where, n_probe=n_probe, exclude=ind)
+
+    def results_to_labels(self, indices):
+        """Convert result indices from `query()` to document labels (None for missing results)."""
+        return [[self.doc_labels[i] if i >= 0 else None for i in row] for row in indices]
+
+    def _scores(self, query_repr, docs, metric):
+        """
+        Similarity scores (the larger the more similar) between the queries and documents `docs` (slice or index
+        array).
+        """
+        if metric == 'jensen_shannon':
+            # JS divergence: entropy of the mixture minus the mean of the entropies
+            doc_topic = self.doc_topic[docs]
+            if self._topic_mask is None:
+                doc_entropy = self._doc_entropy[docs]
+            else:   # renormalize the documents over the included topics
+                doc_topic = doc_topic * self._topic_mask / self._doc_mass[docs][:, np.newaxis]
+                doc_entropy = _entropy_rows(doc_topic)
+            query_entropy = _entropy_rows(query_repr)
+            chunk = max(1, JS_MAX_BLOCK_ELEMENTS // max(1, len(query_repr) * self.n_topics))
+            scores = np.empty((len(query_repr), len(doc_topic)), dtype=np.float32)
+            for start in range(0, len(doc_topic), chunk):
+                stop = start + chunk
+                mixture = (query_repr[:, np.newaxis, :] + doc_topic[np.newaxis, start:stop, :]) / 2
+                js = _entropy_rows(mixture) - (query_entropy[:, np.newaxis] + doc_entropy[np.newaxis, start:stop]) / 2
+                scores[:, start:stop] = -js
+        else:
+            scores = np.dot(query_repr, self._doc_repr[metric][docs].T)
+            if self._doc_scale is not None:
+                scores *= self._doc_scale[metric][docs]
+
+        if self._doc_valid is not None:
+            scores[:, ~self._doc_valid[docs]] = -np.inf
+
+        return scores
+
+    def _query_repr(self, queries, metric):
+        if metric == 'hellinger':
+            return np.sqrt(queries)
+        elif metric == 'cosine':
+            return _normalize_rows(queries, norm='l2')
+        else:
+            return queries
+
+    @staticmethod
+    def _scores_to_distances(scores, metric):
+        with np.errstate(invalid='ignore'):
+            if metric == 'hellinger':
+                dists = np.sqrt(np.maximum(0, 1 - scores))
+            elif metric == 'cosine':
+                dists = 1 - scores
+            else:
+                dists = np.sqrt(np.maximum(0, -scores / np.log(2)))   # normalized to range [0, 1]
+
+        dists[~np.isfinite(scores)] = np.nan
+        return dists
+
+    def _topk_exact(self, queries, k, metric, mask, exclude):
+        n_queries = len(queries)
+        query_repr = self._query_repr(queries, metric)
+        best_scores = np.empty((n_queries, 0), dtype=np.float32)
+        best_indices = np.empty((n_queries, 0), dtype=np.int64)
+        rows = np.arange(n_queries)
+
+        for start in range(0, self.n_docs, self.block_size):
+            stop = min(start + self.block_size, self.n_docs)
+            scores = self._scores(query_repr, slice(start, stop), metric)
+
+            if mask is not None:
+                scores[:, ~mask[start:stop]] = -np.inf
+            if exclude is not None:
+                in_block = (exclude >= start) & (exclude < stop)
+                scores[rows[in_block], exclude[in_block] - start] = -np.inf
+
+            cand_scores = np.hstack((best_scores, scores))
+            cand_indices = np.hstack((best_indices, np.tile(np.arange(start, stop), (n_queries, 1))))
+            if cand_scores.shape[1] > k:
+                top = np.argpartition(-cand_scores, k - 1, axis=1)[:, :k]
+                cand_scores = cand_scores[rows[:, np.newaxis], top]
+                cand_indices = cand_indices[rows[:, np.newaxis], top]
+            best_scores, best_indices = cand_scores, cand_indices
+
+        order = np.argsort(-best_scores, axis=1)
+        return best_scores[rows[:, np.newaxis], order], best_indices[rows[:, np.newaxis], order]
+
+    def _topk_approximate(self, queries, k, metric, mask, exclude, n_probe):
+        n_queries = len(queries)
+        query_repr = self._query_repr(queries, metric)
+        best_scores = np.full((n_queries, k), -np.inf, dtype=np.float32)
+        best_indices = np.full((n_queries, k), -1, dtype=np.int64)
+
+        # clusters are formed in Hellinger space, hence find the closest clusters in this space for all metrics
+        centroid_scores = np.dot(np.sqrt(queries), self.centroids.T)
+        n_probe = min(n_probe, len(self.centroids))
+        probes = np.argpartition(-centroid_scores, n_probe - 1, axis=1)[:, :n_probe]
+
+        for i in range(n_queries):
+            cand = np.concatenate([self.cluster_members[c] for c in probes[i]])
+            if mask is not None:
+                cand = cand[mask[cand]]
+            if exclude is not None:
+                cand = cand[cand != exclude[i]]
+            if len(cand) == 0:
+                continue
+
+            scores = self._scores(query_repr[i:i+1], cand, metric)[0]
+            n = min(k, len(cand))
+            top = np.argpartition(-scores, n - 1)[:n]
+            top = top[np.argsort(-scores[top])]
+            best_scores[i, :n] = scores[top]
+            best_indices[i, :n] = cand[top]
+
+        return best_scores, best_indices
+
+
+def load_index(path):
+    """Load a similarity index that was saved with `DocTopicIndex.save()`."""
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def build_index_for_model(model_file, index_pickle=None, with_speaker_meta=True,
+                          speeches_merged_pickle=SPEECHES_MERGED_PICKLE, tops_csv=TOPS_CSV, mdb_csv=MDB_CSV,
+                          **index_kwargs):
+    """
+    Build the similarity index for the model stored in `model_file` and save it to `index_pickle` (default: next to
+    the model file, see `index_path_for_model()`). `model_file` may be a pickled model or a compact model file (from
+    which only the document labels and the document-topic distribution are loaded). If `with_speaker_meta` is True,
+    the party and date of each speech are loaded from `speeches_merged_pickle`, `tops_csv` and `mdb_csv` (see
+    `doc_meta.load_doc_meta()`) so that they can be used as filters. `index_kwargs` are passed to `DocTopicIndex`.
+    """
+    index_pickle = index_pickle or index_path_for_model(model_file)
+
+    print('loading model from `%s`' % model_file)
+    if model_file.endswith('.npz'):
+        model = load_compact_model(model_file)
+        doc_labels = model.doc_labels
+    else:
+        # import tmtoolkit only here because it is slow to load
+        from tmtoolkit.utils import unpickle_file
+        doc_labels, vocab, dtm, model = unpickle_file(model_file)
+
+    if with_speaker_meta:
+        doc_meta = load_doc_meta(doc_labels, speeches_merged_pickle=speeches_merged_pickle, tops_csv=tops_csv,
+                                 mdb_csv=mdb_csv)
+    else:
+        doc_meta = None
+
+    print('building %s similarity index for %d documents'
+          % ('approximate' if index_kwargs.get('approximate') else 'exact', len(doc_labels)))
+    index = DocTopicIndex(model.doc_topic_, doc_labels, doc_meta=doc_meta, **index_kwargs)
+
+    print('saving similarity index to `%s`' % index_pickle)
+    index.save(index_pickle)
+
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the document similarity index for a model.')
+    parser.add_argument('model_file', help='model file, e.g. data/model2.npz or data/model2.pickle')
+    parser.add_argument('--approximate', action='store_true', help='use the clustering-based approximate mode')
+    parser.add_argument('--no-speaker-meta', action='store_true', help='do not load party and date of the speeches')
+    args = parser.parse_args()
+
+    build_index_for_model(args.model_file, with_speaker_meta=not args.no_speaker_meta,
+                          approximate=args.approximate)
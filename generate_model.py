@@ -8,6 +8,8 @@ As parameter, pass which data should be loaded, i.e. with which preprocessing pi
   1 -> use merged speeches, default pipeline
   2 -> use merged speeches, remove salutatory addresses, default pipeline
 
+Can be run as script or via `generate_model()` (which is what the pipeline runner in `pipeline.py` does). Set
+`TM_HEADLESS=1` to run it without displaying any plots (see `plotting.py`).
 
 Markus Konrad <markus.konrad@wzb.eu>
 """
@@ -16,96 +18,143 @@ from __future__ import division
 import sys
 from pprint import pprint
 
-import matplotlib.pyplot as plt
 import numpy as np
-from lda import LDA
-from tmtoolkit.topicmod.model_io import print_ldamodel_doc_topics, print_ldamodel_topic_words, \
-    save_ldamodel_summary_to_excel
-from tmtoolkit.utils import unpickle_file, pickle_data
 
-#%% input args
-
-if len(sys.argv) != 2:
-    print('run script as: %s  <tokens preprocessing pipeline>' % sys.argv[0])
-    print('<tokens preprocessing pipeline> must be 1 or 2')
-    exit(1)
-
-toks = int(sys.argv[1])
-
-assert toks in (1, 2)
+from model_store import save_compact_model
+from plotting import pyplot, finish_plot
 
 #%% model hyperparameters
 
+# best hyperparameters per tokens preprocessing pipeline
+MODEL_HYPERPARAMS = {
+    1: dict(K=130, alpha_mod=10.0, beta=0.1),
+    2: dict(K=130, alpha_mod=10.0, beta=0.1),
+}
 
-if toks == 1:
-    K = 130
-    alpha_mod = 10.0
-    beta = 0.1
-elif toks == 2:
-    K = 130
-    alpha_mod = 10.0
-    beta = 0.1
-else:
-    print('<tokens preprocessing pipeline> must be 1 or 2')
-    exit(2)
-
-LDA_PARAMS = dict(
-    n_topics=K,
-    alpha=alpha_mod/K,
-    eta=beta,
-    n_iter=2000
-)
+N_ITER = 2000
 
 # other parameters
 BURNIN = 5   # with a default of refresh=10 this means 50 burnin iterations
 
 # paths to data files
 
-DATA_PICKLE_DTM = 'data/speeches_tokens_%d.pickle' % toks
-LDA_MODEL_PICKLE = 'data/model%d.pickle' % toks
-LDA_MODEL_LL_PLOT = 'data/model%d_logliks.png' % toks
-LDA_MODEL_EXCEL_OUTPUT = 'data/model%d_results.xlsx' % toks
-
-#%% load
-print('input tokens from preprocessing pipeline %d' % toks)
-
-print('loading DTM from `%s`...' % DATA_PICKLE_DTM)
-doc_labels, vocab, dtm, tokens = unpickle_file(DATA_PICKLE_DTM)
-assert len(doc_labels) == dtm.shape[0]
-assert len(vocab) == dtm.shape[1]
-print('loaded DTM with %d documents, %d vocab size, %d tokens' % (len(doc_labels), len(vocab), dtm.sum()))
-
-#%% compute model
-
-print('generating model with parameters:')
-pprint(LDA_PARAMS)
-
-model = LDA(**LDA_PARAMS)
-model.fit(dtm)
-
-#%% output
-
-print('saving model to `%s`' % LDA_MODEL_PICKLE)
-pickle_data((doc_labels, vocab, dtm, model), LDA_MODEL_PICKLE)
-
-print('saving results to `%s`' % LDA_MODEL_EXCEL_OUTPUT)
-save_ldamodel_summary_to_excel(LDA_MODEL_EXCEL_OUTPUT, model.topic_word_, model.doc_topic_, doc_labels, vocab, dtm=dtm)
-
-#%%
-print('displaying loglikelihoods...')
-plt.plot(np.arange(BURNIN, len(model.loglikelihoods_)) * 10, model.loglikelihoods_[BURNIN:])
-plt.xlabel('iterations')
-plt.ylabel('log likelihood')
-plt.savefig(LDA_MODEL_LL_PLOT)
-plt.show()
-
-#%%
-print('topic-word distribution:')
-print('-----')
-print_ldamodel_topic_words(model.topic_word_, vocab)
-print('-----')
+DATA_PICKLE_DTM = 'data/speeches_tokens_%d.pickle'
+LDA_MODEL_PICKLE = 'data/model%d.pickle'
+LDA_MODEL_COMPACT = 'data/model%d.npz'
+LDA_MODEL_LL_PLOT = 'data/model%d_logliks.png'
+LDA_MODEL_EXCEL_OUTPUT = 'data/model%d_results.xlsx'
+
+
+def generate_model(toks, K=None, alpha_mod=None, beta=None, n_iter=N_ITER, random_state=None,
+                   dtm_pickle=None, model_pickle=None, compact_model=None, ll_plot=None, excel_output=None,
+                   compact_tol=None, compact_top_k=None, save_pickle=True, print_results=True):
+    """
+    Generate the final LDA model from the DTM of tokens preprocessing pipeline `toks`.
+
+    Hyperparameters that are not given are taken from `MODEL_HYPERPARAMS`; paths to input and output files that are
+    not given are formed from the default path templates with `toks`. The model is saved in the compact format to
+    `compact_model` (see `model_store.py`) with optional sparsification parameters `compact_tol` and `compact_top_k`.
+    If `save_pickle` is True, the full `lda.LDA` object is also pickled together with the DTM to `model_pickle` (this
+    is only needed for the token-level topic assignments and needs much more disk space). The log likelihood plot is
+    saved to `ll_plot` and displayed unless in headless mode. If `print_results` is True, the topic-word and
+    document-topic distributions are printed.
+    """
+
+    if toks not in MODEL_HYPERPARAMS:
+        raise ValueError('`toks` must be one of %s' % ', '.join(map(str, sorted(MODEL_HYPERPARAMS.keys()))))
+
+    default_hyperparams = MODEL_HYPERPARAMS[toks]
+    K = K or default_hyperparams['K']
+    alpha_mod = alpha_mod or default_hyperparams['alpha_mod']
+    beta = beta or default_hyperparams['beta']
+
+    LDA_PARAMS = dict(
+        n_topics=K,
+        alpha=alpha_mod/K,
+        eta=beta,
+        n_iter=n_iter
+    )
+
+    if random_state is not None:
+        LDA_PARAMS['random_state'] = random_state
+
+    dtm_pickle = dtm_pickle or DATA_PICKLE_DTM % toks
+    model_pickle = model_pickle or LDA_MODEL_PICKLE % toks
+    compact_model = compact_model or LDA_MODEL_COMPACT % toks
+    ll_plot = ll_plot or LDA_MODEL_LL_PLOT % toks
+    excel_output = excel_output or LDA_MODEL_EXCEL_OUTPUT % toks
+
+    # import these only here because they are slow to load
+    from lda import LDA
+    from tmtoolkit.topicmod.model_io import print_ldamodel_doc_topics, print_ldamodel_topic_words, \
+        save_ldamodel_summary_to_excel
+    from tmtoolkit.utils import unpickle_file, pickle_data
+
+    #%% load
+    print('input tokens from preprocessing pipeline %d' % toks)
+
+    print('loading DTM from `%s`...' % dtm_pickle)
+    doc_labels, vocab, dtm, tokens = unpickle_file(dtm_pickle)
+    assert len(doc_labels) == dtm.shape[0]
+    assert len(vocab) == dtm.shape[1]
+    print('loaded DTM with %d documents, %d vocab size, %d tokens' % (len(doc_labels), len(vocab), dtm.sum()))
+
+    #%% compute model
+
+    print('generating model with parameters:')
+    pprint(LDA_PARAMS)
+
+    model = LDA(**LDA_PARAMS)
+    model.fit(dtm)
+
+    #%% output
+
+    if save_pickle:
+        print('saving model to `%s`' % model_pickle)
+        pickle_data((doc_labels, vocab, dtm, model), model_pickle)
+
+    print('saving compact model to `%s`' % compact_model)
+    save_compact_model(compact_model, doc_labels, vocab, dtm, model, tol=compact_tol, top_k=compact_top_k)
+
+    print('saving results to `%s`' % excel_output)
+    save_ldamodel_summary_to_excel(excel_output, model.topic_word_, model.doc_topic_, doc_labels, vocab, dtm=dtm)
+
+    #%%
+    print('saving loglikelihoods plot to `%s`...' % ll_plot)
+    plt = pyplot()
+    fig = plt.figure()
+    plt.plot(np.arange(BURNIN, len(model.loglikelihoods_)) * 10, model.loglikelihoods_[BURNIN:])
+    plt.xlabel('iterations')
+    plt.ylabel('log likelihood')
+    finish_plot(fig, ll_plot, block=True)
+
+    #%%
+    if print_results:
+        print('topic-word distribution:')
+        print('-----')
+        print_ldamodel_topic_words(model.topic_word_, vocab)
+        print('-----')
+
+        print('document-topic distribution:')
+        print('-----')
+        print_ldamodel_doc_topics(model.doc_topic_, doc_labels)
+        print('-----')
+
+    return model
+
+
+if __name__ == '__main__':
+    #%% input args
+
+    if len(sys.argv) != 2:
+        print('run script as: %s  <tokens preprocessing pipeline>' % sys.argv[0])
+        print('<tokens preprocessing pipeline> must be 1 or 2')
+        exit(1)
+
+    toks = int(sys.argv[1])
+
+    if toks not in MODEL_HYPERPARAMS:
+        print('<tokens preprocessing pipeline> must be 1 or 2')
+        exit(2)
 
-print('document-topic distribution:')
-print('-----')
-print_ldamodel_doc_topics(model.doc_topic_, doc_labels)
-print('-----')
+    generate_model(toks)
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Compact storage format for topic models as alternative to pickling the whole `lda.LDA` object together with the DTM.
+
+A compact model file is a NumPy `.npz` archive that stores:
+
+- the document labels, vocabulary and the DTM in sparse (CSR) format with int32 counts
+- the document lengths and term frequencies, so that many model statistics don't need the DTM at all
+- the count matrices `nzw_`, `ndz_` and `nz_` as int32
+- the document-topic distribution (theta) and topic-word distribution (phi) as float32, optionally sparsified: for
+  each row, only the largest entries that make up at least 1 - `tol` of the probability mass are kept (and at most
+  `top_k` entries); the rows are renormalized when loading
+- the log likelihoods and hyperparameters
+
+The token-level topic assignments of the `lda.LDA` object are not stored. The members of the archive are only loaded
+when they are accessed, so that e.g. loading only theta and phi from a large model is fast.
+
+Run as script to convert a pickled model (as generated by `generate_model.py`) to the compact format:
+
+  python model_store.py <model pickle> [--tol TOL] [--top-k TOP_K] [--compress]
+
+Markus Konrad <markus.konrad@wzb.eu>
+"""
+
+import argparse
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+SPARSIFIED_MATRICES = ('doc_topic', 'topic_word')
+
+
+def compact_model_path(model_pickle):
+    """Return the path of the compact model file for the model stored in `model_pickle`."""
+    return os.path.splitext(model_pickle)[0] + '.npz'
+
+
+def sparsify_rows(mat, tol=None, top_k=None):
+    """
+    Sparsify the rows of the (row-normalized) matrix `mat`: For each row, keep the largest entries that make up at
+    least 1 - `tol` of the row sum and at most `top_k` entries (at least one entry is always kept). Return a float32
+    CSR matrix.
+    """
+    mat = np.asarray(mat)
+    n_rows, n_cols = mat.shape
+    order = np.argsort(-mat, axis=1)
+    rows = np.arange(n_rows)[:, np.newaxis]
+    sorted_vals = mat[rows, order]
+
+    n_keep = np.full(n_rows, n_cols, dtype=np.int64)
+    if tol is not None:
+        cum_mass = np.cumsum(sorted_vals, axis=1)
+        required_mass = (1 - tol) * sorted_vals.sum(axis=1, keepdims=True)
+        n_keep = np.minimum(n_keep, np.sum(cum_mass < required_mass, axis=1) + 1)
+    if top_k is not None:
+        n_keep = np.minimum(n_keep, top_k)
+    n_keep = np.maximum(n_keep, 1)
+
+    keep = np.arange(n_cols)[np.newaxis, :] < n_keep[:, np.newaxis]
+    indptr = np.concatenate(([0], np.cumsum(n_keep)))
+
+    return csr_matrix((sorted_vals[keep].astype(np.float32), order[keep].astype(np.int32), indptr),
+                      shape=(n_rows, n_cols))
+
+
+def save_compact_model(path, doc_labels, vocab, dtm, model, tol=None, top_k=None, sparsify=SPARSIFIED_MATRICES,
+                       compress=False):
+    """
+    Save the `lda.LDA` model `model` with its `doc_labels`, `vocab` and `dtm` in the compact format to `path`. If
+    `tol` or `top_k` is given, the matrices named in `sparsify` ("doc_topic" and/or "topic_word") are sparsified with
+    `sparsify_rows()`. If `compress` is True, the archive is compressed (smaller, but slower to load).
+    """
+    dtm = csr_matrix(dtm, dtype=np.int32)
+
+    data = dict(
+        doc_labels=np.array(list(doc_labels)),
+        vocab=np.array(list(vocab)),
+        dtm_data=dtm.data,
+        dtm_indices=dtm.indices.astype(np.int32),
+        dtm_indptr=dtm.indptr.astype(np.int64),
+        dtm_shape=np.array(dtm.shape, dtype=np.int64),
+        doc_lengths=np.asarray(dtm.sum(axis=1), dtype=np.int32).ravel(),
+        term_frequencies=np.asarray(dtm.sum(axis=0), dtype=np.int32).ravel(),
+        nzw=model.nzw_.astype(np.int32),
+        ndz=model.ndz_.astype(np.int32),
+        nz=model.nz_.astype(np.int32),
+        loglikelihoods=np.asarray(model.loglikelihoods_, dtype=np.float64),
+        hyperparams=np.array([model.n_topics, model.alpha, model.eta, model.n_iter], dtype=np.float64),
+    )
+
+    for name, mat in (('doc_topic', model.doc_topic_), ('topic_word', model.topic_word_)):
+        if name in sparsify and (tol is not None or top_k is not None):
+            sparse = sparsify_rows(mat, tol=tol, top_k=top_k)
+            data[name + '_data'] = sparse.data
+            data[name + '_indices'] = sparse.indices
+            data[name + '_indptr'] = sparse.indptr.astype(np.int64)
+            data[name + '_shape'] = np.array(mat.shape, dtype=np.int64)
+        else:
+            data[name] = np.asarray(mat, dtype=np.float32)
+
+    with open(path, 'wb') as f:
+        if compress:
+            np.savez_compressed(f, **data)
+        else:
+            np.savez(f, **data)
+
+
+class CompactModel(object):
+    """
+    Model loaded from a compact model file. Each part of the model is only loaded from the file when it is accessed
+    for the first time. The model distributions and counts are available under the same names as for an `lda.LDA`
+    object (`doc_topic_`, `topic_word_`, `nzw_`, `ndz_`, `nz_`, `loglikelihoods_`, `n_topics`, `alpha`, `eta`).
+    """
+    def __init__(self, path):
+        self.path = path
+        self._npz = np.load(path)
+        self._cache = {}
+
+    def close(self):
+        self._npz.close()
+
+    def _get(self, name, load):
+        if name not in self._cache:
+            self._cache[name] = load()
+        return self._cache[name]
+
+    def _load_csr(self, name, dtype):
+        return csr_matrix((self._npz[name + '_data'].astype(dtype), self._npz[name + '_indices'],
+                           self._npz[name + '_indptr']), shape=tuple(self._npz[name + '_shape']))
+
+    def _load_distrib(self, name):
+        if name in self._npz.files:
+            return self._npz[name]
+        else:   # sparsified: renormalize rows
+            mat = self._load_csr(name, np.float32).toarray()
+            return mat / mat.sum(axis=1, keepdims=True)
+
+    def is_sparsified(self, name):
+        """Return True if matrix `name` ("doc_topic" or "topic_word") was sparsified when it was saved."""
+        return name not in self._npz.files
+
+    @property
+    def doc_labels(self):
+        return self._get('doc_labels', lambda: self._npz['doc_labels'])
+
+    @property
+    def vocab(self):
+        return self._get('vocab', lambda: self._npz['vocab'])
+
+    @property
+    def dtm(self):
+        return self._get('dtm', lambda: self._load_csr('dtm', np.int32))
+
+    @property
+    def doc_lengths(self):
+        return self._get('doc_lengths', lambda: self._npz['doc_lengths'])
+
+    @property
+    def term_frequencies(self):
+        return self._get('term_frequencies', lambda: self._npz['term_frequencies'])
+
+    @property
+    def doc_topic_(self):
+        return self._get('doc_topic', lambda: self._load_distrib('doc_topic'))
+
+    @property
+    def topic_word_(self):
+        return self._get('topic_word', lambda: self._load_distrib('topic_word'))
+
+    @property
+    def nzw_(self):
+        return self._get('nzw', lambda: self._npz['nzw'])
+
+    @property
+    def ndz_(self):
+        return self._get('ndz', lambda: self._npz['ndz'])
+
+    @property
+    def nz_(self):
+        return self._get('nz', lambda: self._npz['nz'])
+
+    @property
+    def loglikelihoods_(self):
+        return self._get('loglikelihoods', lambda: self._npz['loglikelihoods'])
+
+    @property
+    def n_topics(self):
+        return int(self._npz['hyperparams'][0])
+
+    @property
+    def alpha(self):
+        return float(self._npz['hyperparams'][1])
+
+    @property
+    def eta(self):
+        return float(self._npz['hyperparams'][2])
+
+
+def load_compact_model(path):
+    """Open the compact model file `path`. Return a `CompactModel`."""
+    return CompactModel(path)
+
+
+def convert_model_pickle(model_pickle, compact_model=None, **save_kwargs):
+    """
+    Convert the pickled model `model_pickle` (as generated by `generate_model.py`) to a compact model file
+    `compact_model` (default: same path with ".npz" extension). `save_kwargs` are passed to `save_compact_model()`.
+    """
+    # import tmtoolkit only here because it is slow to load
+    from tmtoolkit.utils import unpickle_file
+
+    compact_model = compact_model or compact_model_path(model_pickle)
+
+    print('loading model from `%s`' % model_pickle)
+    doc_labels, vocab, dtm, model = unpickle_file(model_pickle)
+
+    print('saving compact model to `%s`' % compact_model)
+    save_compact_model(compact_model, doc_labels, vocab, dtm, model, **save_kwargs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert a pickled model to the compact model format.')
+    parser.add_argument('model_pickle', help='model file, e.g. data/model2.pickle')
+    parser.add_argument('--tol', type=float, default=None,
+                        help='sparsify theta and phi, dropping at most this probability mass per row')
+    parser.add_argument('--top-k', type=int, default=None,
+                        help='sparsify theta and phi, keeping at most this many entries per row')
+    parser.add_argument('--compress', action='store_true', help='compress the archive')
+    args = parser.parse_args()
+
+    convert_model_pickle(args.model_pickle, tol=args.tol, top_k=args.top_k, compress=args.compress)
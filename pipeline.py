@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+"""
+Pipeline runner: Run the whole workflow -- preprocessing the raw data, generating the DTMs, evaluating topic models,
+generating the final models -- as one pipeline that is defined in a JSON configuration file (see `pipeline.json`).
+
+The stages of the pipeline form a directed acyclic graph. Each stage gets a fingerprint that is computed from its
+parameters, the source code of the script that implements it (including the local modules that this script imports)
+and the fingerprints of its inputs. A stage is only run when its fingerprint changed since the last successful run or
+when one of its output files is missing. Stages that do not depend on each other (e.g. the preprocessing pipelines
+0, 1 and 2) are run concurrently in separate processes. All stages are run in headless mode (see `plotting.py`),
+i.e. plots are only saved to files and never displayed.
+
+Run as:
+
+  python pipeline.py [-c CONFIG] [-j MAX_WORKERS] [--force] [--dry-run] [STAGE ...]
+
+If stage names are given, only these stages and the stages they depend on are run.
+
+Markus Konrad <markus.konrad@wzb.eu>
+"""
+
+import argparse
+import ast
+import hashlib
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+from doc_similarity import index_path_for_model
+from plotting import set_headless
+from vis_prep import vis_data_path_for_model
+
+
+DEFAULT_CONFIG_FILE = 'pipeline.json'
+
+# paths relative to the data directory / figures directory set in the configuration
+RAW_DATA_DIR = 'offenesparlament-sessions-csv'
+SPEECHES_SEPARATE_PICKLE = 'speeches_separate.pickle'
+SPEECHES_MERGED_PICKLE = 'speeches_merged.pickle'
+DTM_PICKLE = 'speeches_tokens_%d.pickle'
+EVAL_RESULTS_PICKLE = 'tm_eval_results_tok%d_eta_%.2f_alphamod_%.2f.pickle'
+EVAL_RESULTS_PLOT = 'tm_eval_results_tok%d_eta_%.2f_alphamod_%.2f.png'
+MODEL_PICKLE = '%s.pickle'
+MODEL_COMPACT = '%s.npz'
+MODEL_LL_PLOT = '%s_logliks.png'
+MODEL_EXCEL_OUTPUT = '%s_results.xlsx'
+# the similarity index and the visualization data are stored next to the compact model, see
+# `doc_similarity.index_path_for_model()` and `vis_prep.vis_data_path_for_model()`
+TOPS_CSV = 'offenesparlament-tops.csv'
+MDB_CSV = 'offenesparlament-mdb.csv'
+STATE_FILE = 'pipeline_state.json'
+
+POLL_INTERVAL = 0.5   # seconds between checks for finished stages
+
+
+class Stage(object):
+    """
+    A single stage of the pipeline: a call of function `func` (given as "module:function") with keyword arguments
+    `kwargs` that reads the files in `inputs` and writes the files in `outputs`. `deps` are the names of the stages
+    that must be finished before this stage can run.
+    """
+    def __init__(self, name, func, kwargs, inputs, outputs, deps=()):
+        self.name = name
+        self.func = func
+        self.kwargs = kwargs
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+
+    def __repr__(self):
+        return '<Stage %s>' % self.name
+
+
+#%% building the stage graph from the configuration
+
+def load_config(config_file):
+    with open(config_file) as f:
+        return json.load(f)
+
+
+def tokens_stage_name(mode):
+    return 'tokens%d' % mode
+
+
+def stages_from_config(config):
+    """
+    Create the list of stages defined in `config`. Stage names must be unique and all referenced preprocessing
+    pipelines must be defined in the "tokens" section of the configuration.
+    """
+    data_dir = config.get('data_dir', 'data')
+    fig_dir = config.get('fig_dir', 'fig')
+
+    def data_path(p):
+        return os.path.join(data_dir, p)
+
+    speeches_separate = data_path(SPEECHES_SEPARATE_PICKLE)
+    speeches_merged = data_path(SPEECHES_MERGED_PICKLE)
+
+    stages = [Stage('speeches', 'preproc_raw:preprocess_raw',
+                    kwargs=dict(raw_data_path=config.get('raw_data_dir', data_path(RAW_DATA_DIR)),
+                                output_separate_pickle_path=speeches_separate,
+                                output_merged_pickle_path=speeches_merged,
+                                plot_dir=fig_dir),
+                    inputs=[config.get('raw_data_dir', data_path(RAW_DATA_DIR))],
+                    outputs=[speeches_separate, speeches_merged])]
+
+    dtm_pickles = {}
+    for tok_conf in config.get('tokens', []):
+        mode = tok_conf['mode']
+        speeches_pickle = speeches_separate if mode == 0 else speeches_merged
+        dtm_pickles[mode] = data_path(DTM_PICKLE % mode)
+        stages.append(Stage(tokens_stage_name(mode), 'generate_tokens:generate_tokens',
+                            kwargs=dict(preproc_mode=mode,
+                                        speeches_pickle=speeches_pickle,
+                                        output_dtm_pickle=dtm_pickles[mode],
+                                        extra_stopwords=tok_conf.get('extra_stopwords', [])),
+                            inputs=[speeches_pickle],
+                            outputs=[dtm_pickles[mode]],
+                            deps=['speeches']))
+
+    def dtm_for(stage_conf):
+        toks = stage_conf['tokens']
+        if toks not in dtm_pickles:
+            raise ValueError('preprocessing pipeline %d is not defined in the "tokens" section' % toks)
+        return toks, dtm_pickles[toks]
+
+    for eval_conf in config.get('evaluations', []):
+        toks, dtm_pickle = dtm_for(eval_conf)
+        eta = eval_conf['eta']
+        alpha_mod = eval_conf['alpha_mod']
+        fmt_args = (toks, eta, alpha_mod)
+        eval_pickle = data_path(EVAL_RESULTS_PICKLE % fmt_args)
+        eval_plot = os.path.join(fig_dir, EVAL_RESULTS_PLOT % fmt_args)
+        eval_kwargs = dict(preproc_mode=toks, eta=eta, alpha_mod=alpha_mod, n_iter=eval_conf['n_iter'],
+                           dtm_pickle=dtm_pickle, eval_results_pickle=eval_pickle)
+        if 'n_topics' in eval_conf:
+            eval_kwargs['varying_num_topics'] = eval_conf['n_topics']
+        eval_name = 'eval_tok%d_eta_%.2f_alphamod_%.2f' % fmt_args
+        stages.append(Stage(eval_name, 'tm_eval:evaluate_models',
+                            kwargs=eval_kwargs,
+                            inputs=[dtm_pickle],
+                            outputs=[eval_pickle],
+                            deps=[tokens_stage_name(toks)]))
+        stages.append(Stage('plot_' + eval_name, 'tm_eval_plot:plot_evaluation',
+                            kwargs=dict(toks=toks, eta=eta, alpha_mod=alpha_mod,
+                                        eval_results_pickle=eval_pickle, eval_results_plot=eval_plot),
+                            inputs=[eval_pickle],
+                            outputs=[eval_plot],
+                            deps=[eval_name]))
+
+    for model_conf in config.get('models', []):
+        toks, dtm_pickle = dtm_for(model_conf)
+        name = model_conf.get('name', 'model%d' % toks)
+        model_pickle = data_path(MODEL_PICKLE % name)
+        compact_model = data_path(MODEL_COMPACT % name)
+        ll_plot = data_path(MODEL_LL_PLOT % name)
+        excel_output = data_path(MODEL_EXCEL_OUTPUT % name)
+        save_pickle = model_conf.get('save_pickle', False)   # the later stages only need the compact model
+        model_kwargs = dict(toks=toks, dtm_pickle=dtm_pickle, model_pickle=model_pickle, compact_model=compact_model,
+                            ll_plot=ll_plot, excel_output=excel_output, save_pickle=save_pickle,
+                            print_results=False)
+        for param in ('K', 'alpha_mod', 'beta', 'n_iter', 'random_state'):
+            if param in model_conf:
+                model_kwargs[param] = model_conf[param]
+        for param in ('tol', 'top_k'):
+            if param in model_conf.get('compact', {}):
+                model_kwargs['compact_' + param] = model_conf['compact'][param]
+        stages.append(Stage(name, 'generate_model:generate_model',
+                            kwargs=model_kwargs,
+                            inputs=[dtm_pickle],
+                            outputs=([model_pickle] if save_pickle else []) + [compact_model, ll_plot, excel_output],
+                            deps=[tokens_stage_name(toks)]))
+
+        if 'similarity_index' in model_conf:
+            index_kwargs = dict(model_conf['similarity_index'])
+            index_pickle = index_path_for_model(compact_model)
+            index_inputs = [compact_model]
+            index_kwargs.update(model_file=compact_model, index_pickle=index_pickle)
+            if index_kwargs.get('with_speaker_meta', True):
+                meta_paths = dict(speeches_merged_pickle=speeches_merged, tops_csv=data_path(TOPS_CSV),
+                                  mdb_csv=data_path(MDB_CSV))
+                index_kwargs.update(meta_paths)
+                index_inputs.extend(sorted(meta_paths.values()))
+            stages.append(Stage(name + '_simindex', 'doc_similarity:build_index_for_model',
+                                kwargs=index_kwargs,
+                                inputs=index_inputs,
+                                outputs=[index_pickle],
+                                deps=[name, 'speeches']))
+
+        if 'vis' in model_conf:
+            vis_kwargs = dict(model_conf['vis'])
+            vis_pickle = vis_data_path_for_model(compact_model)
+            vis_kwargs.update(model_file=compact_model, cache_file=vis_pickle)
+            stages.append(Stage(name + '_vis', 'vis_prep:prepare_vis_data_for_model',
+                                kwargs=vis_kwargs,
+                                inputs=[compact_model],
+                                outputs=[vis_pickle],
+                                deps=[name]))
+
+    names = [s.name for s in stages]
+    dupl = set(n for n in names if names.count(n) > 1)
+    if dupl:
+        raise ValueError('duplicate stage names in configuration: %s' % ', '.join(sorted(dupl)))
+
+    return stages
+
+
+def sort_stages(stages):
+    """Sort `stages` topologically so that each stage comes after the stages it depends on."""
+    by_name = dict((s.name, s) for s in stages)
+    sorted_stages = []
+    visited = {}   # stage name -> True when finished, False while visiting
+
+    def visit(s):
+        if visited.get(s.name) is False:
+            raise ValueError('cyclic dependency at stage `%s`' % s.name)
+        if s.name in visited:
+            return
+        visited[s.name] = False
+        for d in s.deps:
+            if d not in by_name:
+                raise ValueError('stage `%s` depends on unknown stage `%s`' % (s.name, d))
+            visit(by_name[d])
+        visited[s.name] = True
+        sorted_stages.append(s)
+
+    for s in stages:
+        visit(s)
+
+    return sorted_stages
+
+
+def select_stages(sorted_stages, targets):
+    """Return only the stages named in `targets` and all stages they (indirectly) depend on, keeping the order."""
+    by_name = dict((s.name, s) for s in sorted_stages)
+    unknown = set(targets) - set(by_name.keys())
+    if unknown:
+        raise ValueError('unknown stages: %s' % ', '.join(sorted(unknown)))
+
+    selected = set()
+    queue = list(targets)
+    while queue:
+        name = queue.pop()
+        if name not in selected:
+            selected.add(name)
+            queue.extend(by_name[name].deps)
+
+    return [s for s in sorted_stages if s.name in selected]
+
+
+#%% fingerprints
+
+def file_fingerprint(path):
+    """
+    Fingerprint of an input file that is not produced by the pipeline: based on size and modification time. For a
+    directory, the fingerprints of all files in it are combined.
+    """
+    h = hashlib.sha1()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for fname in sorted(files):
+                fpath = os.path.join(root, fname)
+                h.update(('%s:%s;' % (os.path.relpath(fpath, path), file_fingerprint(fpath))).encode('utf-8'))
+    elif os.path.exists(path):
+        stat = os.stat(path)
+        h.update(('%d:%d' % (stat.st_size, int(stat.st_mtime))).encode('utf-8'))
+    else:
+        h.update(b'<missing>')
+
+    return h.hexdigest()
+
+
+def _local_module_path(modname):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), modname + '.py')
+
+
+def local_imports(modname):
+    """
+    Return the names of the repository-local modules (scripts in this directory) that module `modname` imports,
+    directly or indirectly, including `modname` itself. Imports inside functions are also found.
+    """
+    found = set()
+    queue = [modname]
+    while queue:
+        name = queue.pop()
+        if name in found or not os.path.exists(_local_module_path(name)):
+            continue
+        found.add(name)
+
+        with open(_local_module_path(name), 'rb') as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                queue.extend(alias.name.split('.')[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                queue.append(node.module.split('.')[0])
+
+    return sorted(found)
+
+
+def source_fingerprint(func):
+    """
+    Fingerprint of the source code of the module that implements stage function `func` ("module:function") and of
+    all repository-local modules that it imports (see `local_imports()`).
+    """
+    h = hashlib.sha1()
+    for modname in local_imports(func.split(':')[0]):
+        with open(_local_module_path(modname), 'rb') as f:
+            h.update(('%s:%s;' % (modname, hashlib.sha1(f.read()).hexdigest())).encode('utf-8'))
+    return h.hexdigest()
+
+
+def stage_fingerprints(sorted_stages):
+    """
+    Compute the fingerprints for all stages in `sorted_stages`. An input that is produced by another stage is
+    represented by this stage's fingerprint, so that changing a parameter of a stage also changes the fingerprints of
+    all stages that depend on it (but not of any other stage).
+    """
+    produced_by = {}
+    for s in sorted_stages:
+        for p in s.outputs:
+            produced_by[p] = s.name
+
+    fingerprints = {}
+    for s in sorted_stages:
+        input_fps = []
+        for p in s.inputs:
+            if p in produced_by:
+                input_fps.append([p, fingerprints[produced_by[p]]])
+            else:
+                input_fps.append([p, file_fingerprint(p)])
+
+        data = dict(func=s.func, kwargs=s.kwargs, source=source_fingerprint(s.func), inputs=input_fps)
+        fingerprints[s.name] = hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    return fingerprints
+
+
+def load_state(state_file):
+    if os.path.exists(state_file):
+        with open(state_file) as f:
+            return json.load(f)
+    else:
+        return {}
+
+
+def save_state(state, state_file):
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.rename(tmp_file, state_file)
+
+
+def outdated_stages(sorted_stages, fingerprints, state, force=False):
+    """
+    Return the names of the stages in `sorted_stages` that need to be run: stages whose fingerprint differs from the
+    one recorded in `state`, stages with missing outputs and all stages that depend on these. If `force` is True,
+    all stages are returned.
+    """
+    outdated = set()
+    for s in sorted_stages:
+        if force or state.get(s.name) != fingerprints[s.name] \
+                or not all(os.path.exists(p) for p in s.outputs) \
+                or any(d in outdated for d in s.deps):
+            outdated.add(s.name)
+
+    return outdated
+
+
+#%% running stages
+
+def _run_stage(func, kwargs, log_file=None):
+    """Run stage function `func` ("module:function") with `kwargs`. This is the target for the stage processes."""
+    if log_file:
+        sys.stdout = sys.stderr = open(log_file, 'w')
+
+    set_headless()
+    logging.basicConfig(level=logging.INFO)
+
+    modname, funcname = func.split(':')
+    getattr(importlib.import_module(modname), funcname)(**kwargs)
+
+
+def run_pipeline(stages, state_file, max_workers=1, force=False, dry_run=False, log_dir=None):
+    """
+    Run all outdated stages of `stages` with at most `max_workers` stages running concurrently. The fingerprints of
+    successfully finished stages are recorded in `state_file`; the fingerprint of a stage is removed when it is
+    started, so that only successful runs are recorded. If a stage fails, all stages that depend on it are
+    skipped while the remaining stages are still run.
+
+    Return True if all stages were run successfully (or were already up to date), else False.
+    """
+    sorted_stages = sort_stages(stages)
+    fingerprints = stage_fingerprints(sorted_stages)
+    state = load_state(state_file)
+    outdated = outdated_stages(sorted_stages, fingerprints, state, force=force)
+
+    for s in sorted_stages:
+        print('%s %s' % ('[run] ' if s.name in outdated else '[done]', s.name))
+
+    if dry_run or not outdated:
+        return True
+
+    if log_dir and not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+
+    pending = [s for s in sorted_stages if s.name in outdated]
+    finished = set(s.name for s in sorted_stages if s.name not in outdated)
+    failed = set()
+    running = {}
+
+    while pending or running:
+        for s in list(pending):
+            if any(d in failed for d in s.deps):
+                print('skipping stage `%s` because a stage it depends on failed' % s.name)
+                pending.remove(s)
+                failed.add(s.name)
+            elif len(running) < max_workers and all(d in finished for d in s.deps):
+                log_file = os.path.join(log_dir, s.name + '.log') if log_dir else None
+                print('starting stage `%s`' % s.name + (' (log in `%s`)' % log_file if log_file else ''))
+                # forget the recorded fingerprint, so that partial outputs of a crashed run are not seen as up to date
+                if state.pop(s.name, None) is not None:
+                    save_state(state, state_file)
+                proc = multiprocessing.Process(target=_run_stage, args=(s.func, s.kwargs, log_file), name=s.name)
+                proc.start()
+                running[s.name] = proc
+                pending.remove(s)
+
+        time.sleep(POLL_INTERVAL)
+
+        for name, proc in list(running.items()):
+            if not proc.is_alive():
+                proc.join()
+                del running[name]
+                if proc.exitcode == 0:
+                    print('finished stage `%s`' % name)
+                    finished.add(name)
+                    state[name] = fingerprints[name]
+                    save_state(state, state_file)
+                else:
+                    print('stage `%s` failed with exit code %d' % (name, proc.exitcode))
+                    failed.add(name)
+
+    if failed:
+        print('%d stage(s) failed or were skipped: %s' % (len(failed), ', '.join(sorted(failed))))
+
+    return not failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the topic modeling pipeline defined in a configuration file.')
+    parser.add_argument('targets', nargs='*', help='only run these stages and the stages they depend on')
+    parser.add_argument('-c', '--config', default=DEFAULT_CONFIG_FILE, help='JSON configuration file')
+    parser.add_argument('-j', '--max-workers', type=int, default=None,
+                        help='max. number of stages run concurrently (overrides configuration)')
+    parser.add_argument('--force', action='store_true', help='run all stages even if they are up to date')
+    parser.add_argument('--dry-run', action='store_true', help='only show which stages would be run')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    stages = stages_from_config(config)
+    if args.targets:
+        stages = select_stages(sort_stages(stages), args.targets)
+
+    success = run_pipeline(stages,
+                           state_file=os.path.join(config.get('data_dir', 'data'), STATE_FILE),
+                           max_workers=args.max_workers or config.get('max_workers', 1),
+                           force=args.force,
+                           dry_run=args.dry_run,
+                           log_dir=config.get('log_dir'))
+
+    exit(0 if success else 1)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Helper functions for plotting in interactive and in headless (batch) mode.
+
+matplotlib is only imported when a plot is actually made. In headless mode, the non-interactive "Agg" backend is used,
+plots are only rendered to files and displaying a plot never blocks. Headless mode is enabled by setting the
+environment variable `TM_HEADLESS=1` (e.g. `TM_HEADLESS=1 python generate_model.py 2`), by calling `set_headless()`
+(which is what the pipeline runner does) or automatically on Linux when no display is available.
+
+Markus Konrad <markus.konrad@wzb.eu>
+"""
+
+import os
+import sys
+
+
+HEADLESS_ENV_VAR = 'TM_HEADLESS'
+
+
+def set_headless(headless=True):
+    """Enable or disable headless mode for this process and all processes started from it."""
+    os.environ[HEADLESS_ENV_VAR] = '1' if headless else '0'
+    if headless:
+        # also applies when matplotlib is imported by another package before `pyplot()` is called
+        os.environ['MPLBACKEND'] = 'Agg'
+
+
+def is_headless():
+    """Return True if running in headless mode."""
+    env_val = os.environ.get(HEADLESS_ENV_VAR)
+    if env_val is not None:
+        return env_val not in ('', '0')
+    else:
+        return sys.platform.startswith('linux') and not os.environ.get('DISPLAY')
+
+
+def pyplot():
+    """Import and return `matplotlib.pyplot`. In headless mode, the non-interactive "Agg" backend is used."""
+    import matplotlib
+    if is_headless():
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def plots_requested(plot_dir=None):
+    """Return True if plots should be generated at all, i.e. if they are saved to `plot_dir` or can be displayed."""
+    return bool(plot_dir) or not is_headless()
+
+
+def finish_plot(fig, plot_file=None, block=False, **savefig_kwargs):
+    """
+    Save figure `fig` to `plot_file` if it is given. Display the figure unless in headless mode -- only block if
+    `block` is True. In headless mode, the figure is closed afterwards.
+    """
+    plt = pyplot()
+
+    if plot_file:
+        print('saving plot to file `%s`' % plot_file)
+        fig.savefig(plot_file, **savefig_kwargs)
+
+    if is_headless():
+        plt.close(fig)
+    else:
+        plt.show(block=block)
+
+
+def show_all():
+    """Display all open figures and block until they are closed -- unless in headless mode."""
+    if not is_headless():
+        pyplot().show()
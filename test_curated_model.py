@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the curated model view in `curated_model.py`. Run with `python -m pytest test_curated_model.py`.
+
+Markus Konrad <markus.konrad@wzb.eu>
+"""
+
+from __future__ import division
+
+import numpy as np
+import pytest
+
+from curated_model import CuratedModel
+from doc_similarity import DocTopicIndex
+from model_store import save_compact_model, load_compact_model
+
+
+N_DOCS = 40
+N_TOPICS = 8
+N_VOCAB = 30
+
+
+class _FakeLDA(object):
+    """Stands in for an `lda.LDA` object with the attributes that `save_compact_model()` uses."""
+    def __init__(self, rng):
+        self.n_topics = N_TOPICS
+        self.alpha = 0.1
+        self.eta = 0.01
+        self.n_iter = 10
+        self.doc_topic_ = rng.dirichlet(np.full(N_TOPICS, 0.3), N_DOCS)
+        self.topic_word_ = rng.dirichlet(np.full(N_VOCAB, 0.3), N_TOPICS)
+        self.nzw_ = rng.randint(0, 10, (N_TOPICS, N_VOCAB))
+        self.ndz_ = rng.randint(0, 10, (N_DOCS, N_TOPICS))
+        self.nz_ = self.nzw_.sum(axis=1)
+        self.loglikelihoods_ = -rng.rand(5)
+
+
+@pytest.fixture
+def sparsified_model(tmpdir):
+    rng = np.random.RandomState(1)
+    doc_labels = ['%d_sess1_top1_spk_speaker-%d_seq%d' % (i, i, i) for i in range(N_DOCS)]
+    vocab = ['w%d' % i for i in range(N_VOCAB)]
+    dtm = rng.randint(1, 5, (N_DOCS, N_VOCAB))
+    path = str(tmpdir.join('model.npz'))
+    save_compact_model(path, doc_labels, vocab, dtm, _FakeLDA(rng), top_k=3)
+    return load_compact_model(path)
+
+
+def test_docs_without_mass_on_included_topics(sparsified_model):
+    curated = CuratedModel.from_model(sparsified_model)
+
+    # exclude all topics that the first document has entries for in the sparsified theta
+    doc_topics = np.where(sparsified_model.doc_topic_[0] > 0)[0]
+    curated.exclude(doc_topics)
+
+    assert curated.doc_weights[0] == 0
+    assert np.all(np.isfinite(curated.doc_weights))
+    assert np.all(curated.theta[0] == 0)
+    assert np.all(np.isfinite(curated.theta))
+
+    # the document is left out of the marginal topic distributions
+    marginal_all = curated.marginal_topic_distrib()
+    assert np.all(np.isfinite(marginal_all))
+    assert np.isclose(marginal_all.sum(), 1)
+    assert np.all(marginal_all[doc_topics] == 0)
+
+    groups = curated.marginal_topic_distrib_per_group({'with_doc': [0, 1, 2], 'only_doc': [0]})
+    assert np.allclose(groups['with_doc'], curated.marginal_topic_distrib([1, 2]))
+    assert np.all(groups['only_doc'] == 0)
+
+    assert np.all(np.isfinite(curated.marginal_word_distrib()))
+
+    # including the topics again restores the document
+    curated.include(doc_topics)
+    assert np.isclose(curated.doc_weights[0], 1)
+
+
+@pytest.mark.parametrize('metric', ['hellinger', 'cosine', 'jensen_shannon'])
+def test_masked_similarity_index(sparsified_model, metric):
+    curated = CuratedModel.from_model(sparsified_model)
+    doc_topics = np.where(sparsified_model.doc_topic_[0] > 0)[0]
+    curated.exclude(doc_topics)
+
+    # index over the renormalized theta of the curated model, built from scratch
+    rebuilt = DocTopicIndex(curated.theta, curated.doc_labels)
+    docs = np.arange(1, 6)
+    all_ind, all_dists = rebuilt.similar_docs(docs, k=N_DOCS, metric=metric)
+
+    # compare distances, because the sparsified documents have many ties
+    ind, dists = curated.similar_docs(docs, k=5, metric=metric)
+    assert np.allclose(dists, all_dists[:, :5], atol=1e-4)
+    for row, (res_ind, res_dists) in enumerate(zip(ind, dists)):
+        expected = dict(zip(all_ind[row], all_dists[row]))
+        assert np.allclose(res_dists, [expected[i] for i in res_ind], atol=1e-4)
+
+    # the document without mass on the included topics is never a result
+    ind, _ = curated.similarity_query(sparsified_model.doc_topic_[1:6], k=N_DOCS, metric=metric)
+    assert not np.any(ind == 0)
+
+    # the index over the original model is shared by all masks
+    index = curated.similarity_index()
+    curated.include(doc_topics)
+    assert curated.similarity_index().doc_topic is index.doc_topic
+
+
+def test_masked_similarity_index_reuses_clusters(sparsified_model):
+    curated = CuratedModel.from_model(sparsified_model)
+    index = curated.similarity_index(approximate=True, random_state=1)
+    curated.exclude([0, 1])
+    masked = curated.similarity_index(approximate=True, random_state=1)
+
+    assert masked is not index
+    assert masked.centroids is index.centroids
+    assert masked.cluster_members is index.cluster_members
+
+
+def test_relevance_with_zero_probability_words(sparsified_model):
+    curated = CuratedModel.from_model(sparsified_model)
+    curated.exclude([0])
+
+    for lambda_ in (0, 0.6, 1):
+        rel = curated.topic_word_relevance(lambda_)
+        assert np.all(np.isnan(rel[0]))
+        assert not np.any(np.isnan(rel[curated.included_topics]))
+
+        # words with zero probability in a topic always come last
+        for t in curated.included_topics:
+            nonzero_words = set(curated.vocab[curated.topic_word[t] > 0])
+            top_words = curated.most_relevant_words_for_topic(t, len(nonzero_words) + 2, lambda_)
+            assert set(top_words[:len(nonzero_words)]) == nonzero_words
+
+
+def test_marginal_topic_distrib_per_group_cache(sparsified_model):
+    curated = CuratedModel.from_model(sparsified_model)
+
+    first = curated.marginal_topic_distrib_per_group({'g': [0, 1]})
+    second = curated.marginal_topic_distrib_per_group({'g': [5, 6, 7]})
+
+    assert np.allclose(first['g'], curated.marginal_topic_distrib([0, 1]))
+    assert np.allclose(second['g'], curated.marginal_topic_distrib([5, 6, 7]))
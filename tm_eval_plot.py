@@ -2,46 +2,57 @@
 """
 Generate plots for the evaluation results. Use the same parameters as in `tm_eval.py`.
 
+Can be run as script or via `plot_evaluation()` (which is what the pipeline runner in `pipeline.py` does). Set
+`TM_HEADLESS=1` to only save the plot without displaying it (see `plotting.py`).
+
 Markus Konrad <markus.konrad@wzb.eu>
 """
 
 import sys
 
-import matplotlib.pyplot as plt
-from tmtoolkit.utils import unpickle_file
-from tmtoolkit.topicmod.evaluate import results_by_parameter
-from tmtoolkit.topicmod.visualize import plot_eval_results
+from plotting import pyplot, finish_plot
+from tm_eval import EVAL_RESULTS_PICKLE
+
+EVAL_RESULTS_PLOT = 'fig/tm_eval_results_tok%d_eta_%.2f_alphamod_%.2f.png'
+
+
+def plot_evaluation(toks, eta, alpha_mod, eval_results_pickle=None, eval_results_plot=None):
+    """
+    Plot the evaluation results for tokens preprocessing pipeline `toks`, `eta` and `alpha_mod` loaded from
+    `eval_results_pickle` and save the plot to `eval_results_plot`. The plot is also displayed unless in headless
+    mode. Paths that are not given are formed from the default path templates.
+    """
+    pyplot()   # set up matplotlib before tmtoolkit's visualize module loads it
 
-#%%
+    # import tmtoolkit only here because it is slow to load
+    from tmtoolkit.utils import unpickle_file
+    from tmtoolkit.topicmod.evaluate import results_by_parameter
+    from tmtoolkit.topicmod.visualize import plot_eval_results
 
-if len(sys.argv) != 4:
-    print('run script as: %s  <tokens preprocessing pipeline> <eta> <alpha factor>' % sys.argv[0])
-    print('<tokens preprocessing pipeline> must be 0, 1 or 2')
-    exit(1)
+    #%%
 
-toks = int(sys.argv[1])
-eta = float(sys.argv[2])
-alpha_mod = float(sys.argv[3])
+    picklefile = eval_results_pickle or EVAL_RESULTS_PICKLE % (toks, eta, alpha_mod)
+    print('loading pickle file with evaluation results from `%s`' % picklefile)
 
-#%%
+    eval_results = unpickle_file(picklefile)
+    eval_results_by_n_topics = results_by_parameter(eval_results, 'n_topics')
 
-picklefile = 'data/tm_eval_results_tok%d_eta_%.2f_alphamod_%.2f.pickle' % (toks, eta, alpha_mod)
-print('loading pickle file with evaluation results from `%s`' % picklefile)
+    #%%
 
-eval_results = unpickle_file(picklefile)
-eval_results_by_n_topics = results_by_parameter(eval_results, 'n_topics')
+    fig, axes = plot_eval_results(eval_results_by_n_topics,
+                                  title='Evaluation results for alpha=%.2f/k, beta=%.2f' % (alpha_mod, eta),
+                                  xaxislabel='num. topics (k)')
 
-n_metrics = len(eval_results_by_n_topics[0][1])
+    plot_file_eval_res = eval_results_plot or EVAL_RESULTS_PLOT % (toks, eta, alpha_mod)
+    finish_plot(fig, plot_file_eval_res, block=True)
 
-#%%
+    print('done.')
 
-fig, axes = plot_eval_results(eval_results_by_n_topics,
-                              title='Evaluation results for alpha=%.2f/k, beta=%.2f' % (alpha_mod, eta),
-                              xaxislabel='num. topics (k)')
 
-plot_file_eval_res = 'fig/tm_eval_results_tok%d_eta_%.2f_alphamod_%.2f.png' % (toks, eta, alpha_mod)
-print('saving plot to file `%s`' % plot_file_eval_res)
-plt.savefig(plot_file_eval_res)
-plt.show()
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        print('run script as: %s  <tokens preprocessing pipeline> <eta> <alpha factor>' % sys.argv[0])
+        print('<tokens preprocessing pipeline> must be 0, 1 or 2')
+        exit(1)
 
-print('done.')
+    plot_evaluation(int(sys.argv[1]), float(sys.argv[2]), float(sys.argv[3]))
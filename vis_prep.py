@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Preparation of the visualization data for PyLDAVis with caching.
+
+`pyLDAvis.prepare()` computes the topic coordinates (multidimensional scaling of the Jensen-Shannon distances between
+all topics), the term frequencies and the relevance tables for all values of lambda. This is slow for models with
+many topics. Here, the pairwise topic distances are computed in parallel across topics and the relevance tables are
+computed in parallel by PyLDAVis itself (`n_jobs`). The prepared data is saved next to the model file together with a
+fingerprint of the model's distributions and the preparation parameters, so that it is only computed again when the
+model or the parameters change. When the data is prepared for a model file, the cache also records the size and
+modification time of the file, so that a cache hit doesn't even need to load the model. Loading the cached data takes
+only milliseconds.
+
+Unlike `pyLDAvis.prepare()`, topics are not sorted by their marginal proportion by default (`sort_topics=False`), so
+that topic N in the visualization is the topic with index N-1 in the model, as everywhere else in this project. Pass
+`sort_topics=True` to get PyLDAVis' default numbering.
+
+Run as script to prepare the data for a model (pickled or compact model file, see `model_store.py`):
+
+  python vis_prep.py <model file> [--n-jobs N_JOBS] [--force]
+
+In a notebook:
+
+  ldavis = prepare_vis_data_for_model('data/model1.npz')
+  pyLDAvis.display(ldavis)
+
+Markus Konrad <markus.konrad@wzb.eu>
+"""
+
+from __future__ import division
+import argparse
+import hashlib
+import os
+import pickle
+
+import numpy as np
+
+from model_store import load_compact_model
+
+
+# like PyLDAVis' defaults, but keep the model's topic order (PyLDAVis sorts topics by marginal proportion by default)
+DEFAULT_PREPARE_PARAMS = dict(R=30, lambda_step=0.01, sort_topics=False)
+
+
+def vis_data_path_for_model(model_file):
+    """
+    Return the path of the cached visualization data for the model stored in `model_file`, e.g.
+    "data/model1_npz_ldavis.pickle" for "data/model1.npz". The file extension is part of the path, because a model
+    loaded from the pickled and the compact format differs in the data types (and possibly sparsification).
+    """
+    base, ext = os.path.splitext(model_file)
+    return '%s_%s_ldavis.pickle' % (base, ext.lstrip('.'))
+
+
+def vis_data_fingerprint(topic_word, doc_topic, doc_lengths, vocab, term_frequency, prepare_params):
+    """Fingerprint of the model distributions and the preparation parameters `prepare_params`."""
+    h = hashlib.sha1()
+    for arr in (topic_word, doc_topic, doc_lengths, term_frequency, list(vocab)):
+        arr = np.asarray(arr)
+        h.update(('%s%s' % (arr.dtype, arr.shape)).encode('utf-8'))
+        h.update(arr.tobytes())
+    h.update(repr(sorted(prepare_params.items())).encode('utf-8'))
+    return h.hexdigest()
+
+
+def model_file_fingerprint(model_file, prepare_params):
+    """
+    Cheap fingerprint of the model file `model_file` (path, size and modification time) and the preparation
+    parameters `prepare_params`, which can be checked without loading the model.
+    """
+    stat = os.stat(model_file)
+    data = (os.path.abspath(model_file), stat.st_size, repr(stat.st_mtime), sorted(prepare_params.items()))
+    return hashlib.sha1(repr(data).encode('utf-8')).hexdigest()
+
+
+def _prepare_params(prepare_params):
+    params = DEFAULT_PREPARE_PARAMS.copy()
+    params.update(prepare_params)
+    return params
+
+
+def _load_cache(cache_file):
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+    else:
+        return None
+
+
+def _save_cache(cache_file, cached):
+    with open(cache_file, 'wb') as f:
+        pickle.dump(cached, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _entropy_rows(x):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return -np.where(x > 0, x * np.log(x), 0).sum(axis=-1)
+
+
+def _js_divergences(topic_word, topic_entropy, topics):
+    """Jensen-Shannon divergences between the `topics` and all topics."""
+    res = np.empty((len(topics), len(topic_word)))
+    for i, t in enumerate(topics):
+        mixture = (topic_word[t] + topic_word) / 2
+        res[i] = _entropy_rows(mixture) - (topic_entropy[t] + topic_entropy) / 2
+    return res
+
+
+def topic_distances(topic_word, n_jobs=-1):
+    """
+    Matrix of Jensen-Shannon divergences between all topics in `topic_word`, computed in parallel in `n_jobs`
+    processes (-1 means one per CPU) across the topics.
+    """
+    from joblib import Parallel, delayed, cpu_count
+
+    topic_word = np.asarray(topic_word, dtype=np.float64)
+    topic_entropy = _entropy_rows(topic_word)
+    n_topics = len(topic_word)
+    n_workers = cpu_count() if n_jobs < 0 else n_jobs
+    chunks = np.array_split(np.arange(n_topics), min(n_topics, n_workers * 4))
+
+    dists = Parallel(n_jobs=n_jobs)(delayed(_js_divergences)(topic_word, topic_entropy, chunk) for chunk in chunks)
+    dists = np.vstack(dists)
+    dists = np.maximum((dists + dists.T) / 2, 0)   # remove numerical asymmetries
+    np.fill_diagonal(dists, 0)
+
+    return dists
+
+
+def pcoa(dists, n_components=2):
+    """Principal coordinate analysis (classical multidimensional scaling) of the distance matrix `dists`."""
+    n = dists.shape[0]
+    centering = np.eye(n) - np.ones((n, n)) / n
+    b = -centering.dot(dists ** 2).dot(centering) / 2
+    eigvals, eigvecs = np.linalg.eigh(b)
+    ix = eigvals.argsort()[::-1][:n_components]
+    eigvals = np.maximum(eigvals[ix], 0)
+    return np.sqrt(eigvals) * eigvecs[:, ix]
+
+
+def parallel_js_pcoa(n_jobs=-1):
+    """Return an MDS function for `pyLDAvis.prepare()` like its default "pcoa" that computes distances in parallel."""
+    def mds(topic_word):
+        return pcoa(topic_distances(np.asarray(topic_word), n_jobs=n_jobs))
+    return mds
+
+
+def prepare_vis_data(topic_word, doc_topic, doc_lengths, vocab, term_frequency, cache_file=None, n_jobs=-1,
+                     force=False, model_file_fp=None, **prepare_params):
+    """
+    Prepare the PyLDAVis data for a model with topic-word distribution `topic_word`, document-topic distribution
+    `doc_topic`, `doc_lengths`, `vocab` and `term_frequency`. Computations are run in `n_jobs` processes.
+    `prepare_params` are passed to `pyLDAvis.prepare()` (defaults: `DEFAULT_PREPARE_PARAMS`).
+
+    If `cache_file` is given and contains data prepared for the same model and parameters, this data is loaded
+    instead (unless `force` is True). Otherwise, the prepared data is saved to `cache_file`. `model_file_fp` is
+    the fingerprint of the model file the data was loaded from (see `model_file_fingerprint()`), which is recorded in
+    the cache.
+
+    Return the `pyLDAvis.PreparedData` object.
+    """
+    params = _prepare_params(prepare_params)
+    fingerprint = vis_data_fingerprint(topic_word, doc_topic, doc_lengths, vocab, term_frequency, params)
+
+    cached = None if force else _load_cache(cache_file)
+    if cached is not None and cached['fingerprint'] == fingerprint:
+        print('loaded prepared visualization data from `%s`' % cache_file)
+        if model_file_fp is not None and cached.get('model_file_fingerprint') != model_file_fp:
+            # same model in a re-written model file: record the new file so that the next cache check is cheap
+            cached['model_file_fingerprint'] = model_file_fp
+            _save_cache(cache_file, cached)
+        return cached['data']
+
+    # import pyLDAvis only here because it is slow to load
+    import pyLDAvis
+
+    print('preparing visualization data for %d topics' % len(topic_word))
+    data = pyLDAvis.prepare(topic_term_dists=topic_word, doc_topic_dists=doc_topic, doc_lengths=doc_lengths,
+                            vocab=vocab, term_frequency=term_frequency, mds=parallel_js_pcoa(n_jobs), n_jobs=n_jobs,
+                            **params)
+
+    if cache_file:
+        print('saving prepared visualization data to `%s`' % cache_file)
+        _save_cache(cache_file, {'fingerprint': fingerprint, 'model_file_fingerprint': model_file_fp, 'data': data})
+
+    return data
+
+
+def prepare_vis_data_for_model(model_file, cache_file=None, n_jobs=-1, force=False, **prepare_params):
+    """
+    Prepare the PyLDAVis data for the model stored in `model_file` (pickled or compact model file) and cache it in
+    `cache_file` (default: next to the model file, see `vis_data_path_for_model()`). See `prepare_vis_data()`.
+
+    If the cache was created for the same model file (same size and modification time) and parameters, the cached
+    data is returned without loading the model.
+    """
+    cache_file = cache_file or vis_data_path_for_model(model_file)
+    model_file_fp = model_file_fingerprint(model_file, _prepare_params(prepare_params))
+
+    cached = None if force else _load_cache(cache_file)
+    if cached is not None and cached.get('model_file_fingerprint') == model_file_fp:
+        print('loaded prepared visualization data from `%s`' % cache_file)
+        return cached['data']
+
+    if model_file.endswith('.npz'):
+        model = load_compact_model(model_file)
+        doc_lengths = model.doc_lengths
+        term_frequency = model.term_frequencies
+        vocab = model.vocab
+    else:
+        # import tmtoolkit only here because it is slow to load
+        from tmtoolkit.utils import unpickle_file
+        from tmtoolkit.topicmod.model_stats import get_doc_lengths, get_term_frequencies
+        _, vocab, dtm, model = unpickle_file(model_file)
+        doc_lengths = get_doc_lengths(dtm)
+        term_frequency = get_term_frequencies(dtm)
+
+    return prepare_vis_data(model.topic_word_, model.doc_topic_, doc_lengths, list(vocab), term_frequency,
+                            cache_file=cache_file, n_jobs=n_jobs, force=force, model_file_fp=model_file_fp,
+                            **prepare_params)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prepare and cache the PyLDAVis data for a model.')
+    parser.add_argument('model_file', help='model file, e.g. data/model2.npz or data/model2.pickle')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='number of processes (-1 means one per CPU)')
+    parser.add_argument('--force', action='store_true', help='prepare the data even if it is cached')
+    args = parser.parse_args()
+
+    prepare_vis_data_for_model(args.model_file, n_jobs=args.n_jobs, force=args.force)